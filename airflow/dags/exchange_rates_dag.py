@@ -3,7 +3,8 @@ import pendulum
 import yaml
 
 from airflow import DAG
-from airflow.decorators import task
+from airflow.decorators import task, task_group
+from airflow.models.param import Param
 from airflow.operators.empty import EmptyOperator
 from airflow.providers.google.cloud.transfers.gcs_to_bigquery import GCSToBigQueryOperator
 from airflow.providers.google.cloud.transfers.local_to_gcs import LocalFilesystemToGCSOperator
@@ -15,11 +16,20 @@ with DAG(
         schedule_interval="0 5 * * *",
         start_date=pendulum.datetime(2024, 7, 4, tz="Europe/Kiev"),
         catchup=False,
+        max_active_tasks=16,
         tags=["etl", "exchange_rates"],
+        params={
+            "start_date": Param(None, type=["null", "string"], format="date",
+                                description="Backfill start date, defaults to the run date."),
+            "end_date": Param(None, type=["null", "string"], format="date",
+                              description="Backfill end date, defaults to the start date."),
+        },
         doc_md="""
         ### Exchange rates
         This DAG downloads exchange rates data from Open Exchange Rates API and
         uploads it into `GCP` bucket and transfer updates to `BigQuery` main table.
+        Trigger it with `start_date` / `end_date` params to backfill a period,
+        dates are processed in parallel.
         """
 ) as dag:
     start = EmptyOperator(task_id="start")
@@ -36,6 +46,26 @@ with DAG(
 
         return reports_folder_path
 
+    @task
+    def get_dates(ds=None, params=None):
+        from datetime import date, timedelta
+
+        start_date = date.fromisoformat(params['start_date'] or ds)
+        end_date = date.fromisoformat(params['end_date'] or start_date.isoformat())
+        if end_date < start_date:
+            raise ValueError(f'end_date {end_date} must not be earlier than start_date {start_date}.')
+
+        dates = [(start_date + timedelta(days=i)).isoformat() for i in range((end_date - start_date).days + 1)]
+        return [
+            {
+                'date': day,
+                'dst': f'data/{day}/',
+                'source_object': f'data/{day}/exchange_rates_{day}.csv.gz',
+                'table': f'exchange_rates.exchange_rates_{day}',
+            }
+            for day in dates
+        ]
+
     @task
     def clear_report_folder(ti):
         import shutil
@@ -52,31 +82,39 @@ with DAG(
         api_key = config['api_key']
 
         folder_path = create_folder()
+        dates = get_dates()
+
+        @task_group
+        def collect_rates(date, dst, source_object, table):
+            report_path = ExchangeApiOperator(
+                api_key=api_key,
+                date=date,
+                folder_path=folder_path,
+                cache_path='/usr/local/airflow/data/exchange_rates/oer_cache',
+                task_id='collect_data'
+            )
+            upload_data_to_gcs = LocalFilesystemToGCSOperator(
+                task_id="upload_data_to_gcs",
+                gcp_conn_id='google_cloud_default',
+                dst=dst,
+                src=report_path.output,
+                bucket=bucket_id,
+                mime_type='application/gzip',
+            )
+            load_from_gcp_to_bq = GCSToBigQueryOperator(
+                task_id="load_from_gcp_to_bq",
+                bucket=bucket_id,
+                source_objects=source_object,
+                destination_project_dataset_table=table,
+                schema_object='schemes/exchange_rates_schema.json',
+                source_format="CSV",
+                skip_leading_rows=1,
+                write_disposition="WRITE_TRUNCATE",
+            )
+
+            report_path >> upload_data_to_gcs >> load_from_gcp_to_bq
 
-        report_path = ExchangeApiOperator(
-            api_key=api_key,
-            date='{{ ds }}',
-            folder_path=folder_path,
-            task_id='collect_data'
-        )
-        upload_data_to_gcs = LocalFilesystemToGCSOperator(
-            task_id="upload_data_to_gcs",
-            gcp_conn_id='google_cloud_default',
-            dst='data/{{ ds }}/',
-            src="{{ ti.xcom_pull(task_ids='collect_data', key='return_value') }}",
-            bucket=bucket_id,
-            mime_type='csv',
-        )
-        load_from_gcp_to_bq = GCSToBigQueryOperator(
-            task_id="load_from_gcp_to_bq",
-            bucket=bucket_id,
-            source_objects='data/{{ ds }}/exchange_rates_{{ ds }}.csv',
-            destination_project_dataset_table='exchange_rates.exchange_rates_{{ ds }}',
-            schema_object='schemes/exchange_rates_schema.json',
-            source_format="CSV",
-            skip_leading_rows=1,
-            write_disposition="WRITE_TRUNCATE",
-        )
         clear_folder = clear_report_folder()
 
-        start >> folder_path >> report_path >> upload_data_to_gcs >> load_from_gcp_to_bq >> clear_folder >> end
+        start >> [folder_path, dates]
+        collect_rates.expand_kwargs(dates) >> clear_folder >> end
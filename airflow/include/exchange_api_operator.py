@@ -1,17 +1,24 @@
-import requests
 import datetime
 import os
-import pandas as pd
+import gzip
+from functools import cached_property
+import orjson
 from airflow.models.baseoperator import BaseOperator
 from airflow import AirflowException
 
+CSV_HEADER = 'date,base,currency,rate,last_update\n'
+REQUEST_TIMEOUT = 10
+GZIP_COMPRESS_LEVEL = 1
+CACHE_LOCK_TIMEOUT = 30
+
 
 class ExchangeApiOperator(BaseOperator):
     """
-    Operator gets exchange rates data from Open Exchange Rates API and saves it as csv file.
+    Operator gets exchange rates data from Open Exchange Rates API and saves it as gzipped csv file.
     :param api_key: api key (app id) for Open Exchange Rates API.
     :param date: data collection date.
     :param folder_path: path to folder to download data to.
+    :param cache_path: path to SQLite file to cache API responses in, in-memory cache is used if not set.
     """
     template_fields = ("date", "folder_path")
 
@@ -20,6 +27,7 @@ class ExchangeApiOperator(BaseOperator):
             api_key: str,
             date: datetime,
             folder_path: str,
+            cache_path: str | None = None,
             *args,
             **kwargs,
     ):
@@ -28,14 +36,43 @@ class ExchangeApiOperator(BaseOperator):
         self.date = date
         self.base_currency = 'USD'
         self.folder_path = folder_path
+        self.cache_path = cache_path
+
+    @cached_property
+    def session(self):
+        # imported here to keep DAG file parsing light, operator module is imported by the scheduler
+        import requests_cache
+        from requests.adapters import HTTPAdapter
+        from urllib3.util import Retry
+
+        # mapped tasks share one SQLite file: WAL lets readers and a writer work concurrently,
+        # timeout makes writers wait for the lock instead of failing with "database is locked"
+        backend_options = {'wal': True, 'timeout': CACHE_LOCK_TIMEOUT} if self.cache_path else {}
+        # historical rates don't change, so responses are cached forever (app_id is kept out of the cache)
+        session = requests_cache.CachedSession(
+            self.cache_path or 'oer_cache',
+            backend='sqlite' if self.cache_path else 'memory',
+            expire_after=requests_cache.NEVER_EXPIRE,
+            allowable_methods=('GET',),
+            ignored_parameters=['app_id'],
+            **backend_options,
+        )
+        session.mount('https://', HTTPAdapter(
+            max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=[502, 503, 504], raise_on_status=False)
+        ))
+        return session
 
     def get_data(self):
+        from requests_cache import DO_NOT_CACHE, NEVER_EXPIRE
+
         url = (f'https://openexchangerates.org/api/historical/{self.date}.json?'
                f'app_id={self.api_key}&base={self.base_currency}')
-        result = requests.get(url)
+        # rates by current (UTC) day are not final yet, don't cache them
+        is_final = self.date < datetime.datetime.now(datetime.timezone.utc).date().isoformat()
+        result = self.session.get(url, timeout=REQUEST_TIMEOUT, expire_after=NEVER_EXPIRE if is_final else DO_NOT_CACHE)
 
         if not result.ok:
-            error_message = f'API error {result.status_code}: {result.json()["description"]}'
+            error_message = f'API error {result.status_code}: {orjson.loads(result.content)["description"]}'
             raise AirflowException(error_message)
 
         return result
@@ -43,21 +80,22 @@ class ExchangeApiOperator(BaseOperator):
     def process_data(self, result):
         self.log.info("Process data.")
         try:
-            data = result.json()['rates']
-            df = pd.DataFrame([(k, v) for k, v in data.items()], columns=['currency', 'rate'])
+            data = orjson.loads(result.content)['rates']
 
-            if (df['rate'] < 0).any():
+            if None in data.values():
+                raise ValueError('Error value in "rates" column: rate must not be null.')
+            if data and min(data.values()) < 0:
                 raise ValueError('Error value in "rates" column: value must be bigger than 0.')
-            if (df['currency'].isna()).any():
+            if '' in data:
                 raise ValueError('Error value in "currency" column: currency must not be null.')
 
-            df['date'] = self.date
-            df['base'] = self.base_currency
-            df['last_update'] = datetime.datetime.now()
-            df = df[['date', 'base', 'currency', 'rate', 'last_update']]
+            last_update = datetime.datetime.now().isoformat(sep=' ', timespec='seconds')
+            prefix = f'{self.date},{self.base_currency},'
 
-            file_path = os.path.join(self.folder_path, f'exchange_rates_{self.date}.csv')
-            df.to_csv(file_path, index=False)
+            file_path = os.path.join(self.folder_path, f'exchange_rates_{self.date}.csv.gz')
+            with gzip.open(file_path, 'wt', compresslevel=GZIP_COMPRESS_LEVEL) as file:
+                file.write(CSV_HEADER)
+                file.writelines(f'{prefix}{k},{v},{last_update}\n' for k, v in data.items())
             return file_path
 
         except Exception as ex:
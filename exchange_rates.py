@@ -1,16 +1,25 @@
 import argparse
 import logging
-import requests
-import pendulum
+import sys
 import datetime
-import json
 import os
 import io
+import gzip
+import functools
+from concurrent.futures import ThreadPoolExecutor
 
-import pandas as pd
+import orjson
+import requests_cache
 from google.cloud import storage, bigquery
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
 
 GCS_BUCKET_ID = os.environ.get('GCS_BUCKET_ID')
+CSV_HEADER = b'date,base,currency,rate,last_update\n'
+MAX_WORKERS = 8
+REQUEST_TIMEOUT = 10
+GZIP_COMPRESS_LEVEL = 1
+API_CACHE_NAME = 'oer_cache'
 
 logging.basicConfig(
     format='%(asctime)s [%(levelname)s] %(message)s',
@@ -19,9 +28,22 @@ logging.basicConfig(
 )
 
 class ExchangeRates():
-    def __init__(self, api_key: str):
+    def __init__(self, api_key: str, cache_name: str = API_CACHE_NAME):
         self.api_key = api_key
         self.base_currency = 'USD'
+        # historical rates don't change, so responses are cached on disk forever (app_id is kept out of the cache)
+        self.session = requests_cache.CachedSession(
+            cache_name,
+            backend='sqlite',
+            expire_after=requests_cache.NEVER_EXPIRE,
+            allowable_methods=('GET',),
+            ignored_parameters=['app_id'],
+        )
+        self.session.mount('https://', HTTPAdapter(
+            pool_connections=MAX_WORKERS,
+            pool_maxsize=MAX_WORKERS,
+            max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=[502, 503, 504], raise_on_status=False)
+        ))
 
     def get_data(self, date: str) -> dict:
         """
@@ -33,98 +55,100 @@ class ExchangeRates():
             logging.info(f'Trying to get an exchange rates by {date}...')
 
             url = f'https://openexchangerates.org/api/historical/{date}.json?app_id={self.api_key}&base={self.base_currency}'
-            result = requests.get(url)
+            # rates by current (UTC) day are not final yet, don't cache them
+            is_final = date < datetime.datetime.now(datetime.timezone.utc).date().isoformat()
+            expire_after = requests_cache.NEVER_EXPIRE if is_final else requests_cache.DO_NOT_CACHE
+            result = self.session.get(url, timeout=REQUEST_TIMEOUT, expire_after=expire_after)
             if not result.ok:
-                raise Exception(f'API error {result.status_code}: {result.json()["description"]}')
+                raise Exception(f'API error {result.status_code}: {orjson.loads(result.content)["description"]}')
 
-            return result.json()['rates']
+            return orjson.loads(result.content)['rates']
         except Exception as ex:
             logging.error(f'Unable to get data from API by {date}: {ex}')
 
-    def process_data(self, date: str, rates: dict) -> pd.DataFrame:
+    def emit(self, date: str, rates: dict, storage_client) -> None:
         """
-        Processes dict to DataFrame and adds columns.
+        Processes dict to gzipped CSV rows and uploads them to GCP bucket in a single pass.
         :param date: data collection date.
         :param rates: dict with exchange rates.
-        :return: processed data.
+        :param storage_client: GCP storage client.
+        :return:
         """
         try:
             logging.info(f'Processing data by date {date}')
-            df = pd.DataFrame([(k, v) for k, v in rates.items()], columns=['currency', 'rate'])
-            if (df['rate'] < 0).any():
+            if None in rates.values():
+                raise ValueError('Error value in "rates" column: rate must not be null.')
+            if rates and min(rates.values()) < 0:
                 raise ValueError('Error value in "rates" column: value must be bigger than 0.')
-            if (df['currency'].isna()).any():
+            if '' in rates:
                 raise ValueError('Error value in "currency" column: currency must not be null.')
 
-            df['date'] = date
-            df['base'] = self.base_currency
-            df['last_update'] = datetime.datetime.now()
-            df = df[['date', 'base', 'currency', 'rate', 'last_update']]
-            return df
-        except Exception as ex:
-            logging.error(f'Error processing data: {ex}')
+            last_update = datetime.datetime.now().isoformat(sep=' ', timespec='seconds')
+            prefix = f'{date},{self.base_currency},'
+            buffer = io.BytesIO()
+            with gzip.GzipFile(fileobj=buffer, mode='wb', compresslevel=GZIP_COMPRESS_LEVEL, mtime=0) as file:
+                file.write(CSV_HEADER)
+                file.writelines(f'{prefix}{k},{v},{last_update}\n'.encode() for k, v in rates.items())
 
-    @staticmethod
-    def load_file_to_bucket(date: str, data: pd.DataFrame, storage_client) -> None:
-        """
-        Upload data to GCP bucket.
-        :param date: data collection date.
-        :param data: df with data to upload
-        :param storage_client: GCP storage client.
-        :return:
-        """
-        try:
             bucket = storage_client.bucket(GCS_BUCKET_ID)
-
-            string_buffer = io.StringIO()
-            data.to_csv(string_buffer, index=False)
-
-            blob_name = f'data/{date}/exchange_rates_{date}.csv'
+            blob_name = f'data/{date}/exchange_rates_{date}.csv.gz'
             blob = bucket.blob(blob_name)
 
-            blob.upload_from_string(string_buffer.getvalue())
+            # explicit size keeps the upload a single multipart request instead of a resumable one
+            size = buffer.tell()
+            blob.upload_from_file(buffer, size=size, content_type='application/gzip', rewind=True)
             logging.info(f'Upload downloaded report -> {blob_name}')
         except Exception as ex:
-            logging.error(f' Error loading data to bucket: {ex}')
-
+            logging.error(f'Error processing and loading data to bucket: {ex}')
 
     @staticmethod
-    def from_gcs_to_biguery(date: str, storage_client, bigquery_client) -> None:
+    def from_gcs_to_biguery(date: str, storage_client, bigquery_client,
+                            job_config: bigquery.LoadJobConfig) -> bigquery.LoadJob | None:
         """
         Upload data from GCP to BigQuery tables.
+        Load job is started without waiting for its result.
         :param date: data collection date.
         :param storage_client: GCP storage client.
         :param bigquery_client: BigQuery client.
-        :return:
+        :param job_config: BigQuery load job config.
+        :return: started load job or None if there are no files by date.
         """
         logging.info(f'Uploading file from GCS to BQ by {date}...')
 
-        # build report schema
-        bucket = storage_client.bucket(GCS_BUCKET_ID)
-        schema_fields = json.loads(bucket.blob(f'schemes/exchange_rates_schema.json').download_as_string())
-        schema = [bigquery.SchemaField(name=field['name'], field_type=field['type'], mode=field['mode'])
-                  for field in schema_fields]
-
-        # create load job config
-        job_config = bigquery.LoadJobConfig(
-            schema=schema,
-            skip_leading_rows=1,
-            source_format=bigquery.SourceFormat.CSV,
-            write_disposition=bigquery.WriteDisposition.WRITE_APPEND
-        )
-
-        blobs = list(storage_client.list_blobs(GCS_BUCKET_ID, prefix=f'data/{date}/'))
+        # check the same files the wildcard load picks up, older folders may hold only plain .csv files
+        blobs = list(storage_client.list_blobs(GCS_BUCKET_ID, prefix=f'data/{date}/', match_glob='**.csv.gz',
+                                               max_results=1))
         date_index = date.replace('-', '')
         if len(blobs) > 0:
-            # if some blobs exists, delete old table and upload all CSV files to the new one
+            # if some blobs exists, replace table content with all CSV files in a single WRITE_TRUNCATE job
             bq_table = f'exchange_rates.exchange_rates_{date_index}'
-            bigquery_client.delete_table(bq_table, not_found_ok=True)
+            uri = f'gs://{GCS_BUCKET_ID}/data/{date}/*.csv.gz'
+            load_job = bigquery_client.load_table_from_uri(uri, bq_table, job_config=job_config)
+            logging.info(f'Started loading {uri} into BQ table -> {bq_table}')
+            return load_job
 
-            for blob in blobs:
-                uri = f"gs://{GCS_BUCKET_ID}/" + blob.name
-                load_job = bigquery_client.load_table_from_uri(uri, bq_table, job_config=job_config)
-                load_job.result()
-                logging.info(f'Upload {uri} into BQ table -> {bq_table}')
+
+@functools.lru_cache(maxsize=1)
+def get_load_job_config(bucket_id: str, storage_client) -> bigquery.LoadJobConfig:
+    """
+    Builds BigQuery load job config from the report schema stored in GCP bucket.
+    :param bucket_id: GCP bucket id.
+    :param storage_client: GCP storage client.
+    :return: load job config.
+    """
+    # build report schema
+    bucket = storage_client.bucket(bucket_id)
+    schema_fields = orjson.loads(bucket.blob('schemes/exchange_rates_schema.json').download_as_bytes())
+    schema = [bigquery.SchemaField(name=field['name'], field_type=field['type'], mode=field['mode'])
+              for field in schema_fields]
+
+    # create load job config
+    return bigquery.LoadJobConfig(
+        schema=schema,
+        skip_leading_rows=1,
+        source_format=bigquery.SourceFormat.CSV,
+        write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE
+    )
 
 
 def get_gcp_clients():
@@ -148,17 +172,49 @@ if __name__ == '__main__':
     args_parser.add_argument('-e', '--end_date', type=str, required=True, help='Period end date.')
     args = args_parser.parse_args()
 
-    end_date = pendulum.parse(args.end_date)
-    start_date = pendulum.parse(args.start_date)
-    dates = [date.date().isoformat() for date in pendulum.interval(start_date, end_date).range('days')]
+    end_date = datetime.date.fromisoformat(args.end_date)
+    start_date = datetime.date.fromisoformat(args.start_date)
+    if end_date < start_date:
+        args_parser.error('--end_date must not be earlier than --start_date')
+    dates = [(start_date + datetime.timedelta(days=i)).isoformat() for i in range((end_date - start_date).days + 1)]
 
     storage_client, bigquery_client = get_gcp_clients()
     rates_collector = ExchangeRates(api_key=args.app_id)
-    for date in dates:
+    job_config = get_load_job_config(GCS_BUCKET_ID, storage_client)
+
+    def run_one(date: str) -> bigquery.LoadJob | None:
         rates = rates_collector.get_data(date=date)
-        processed_data = rates_collector.process_data(date=date, rates=rates)
-        rates_collector.load_file_to_bucket(date=date, data=processed_data, storage_client=storage_client)
-        rates_collector.from_gcs_to_biguery(date=date, storage_client=storage_client, bigquery_client=bigquery_client)
+        rates_collector.emit(date=date, rates=rates, storage_client=storage_client)
+        return rates_collector.from_gcs_to_biguery(date=date, storage_client=storage_client,
+                                                   bigquery_client=bigquery_client, job_config=job_config)
 
+    failed_jobs = 0
+    load_jobs = []
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        futures = {date: executor.submit(run_one, date) for date in dates}
 
+    # a date that fails before its load job starts mustn't stop waiting for the jobs of other dates
+    for date, future in futures.items():
+        try:
+            load_job = future.result()
+        except Exception as ex:
+            failed_jobs += 1
+            logging.error(f'Error starting BQ load job by {date}: {ex}')
+            continue
+        if load_job is not None:
+            load_jobs.append(load_job)
+
+    # all load jobs run concurrently on BigQuery side, wait for each of them even if some fail
+    for load_job in load_jobs:
+        destination = load_job.destination
+        bq_table = f'{destination.dataset_id}.{destination.table_id}'
+        try:
+            load_job.result()
+            logging.info(f'Upload {", ".join(load_job.source_uris)} into BQ table -> {bq_table}')
+        except Exception as ex:
+            failed_jobs += 1
+            logging.error(f'Error loading data into BQ table {bq_table}: {ex}')
 
+    if failed_jobs:
+        logging.error(f'{failed_jobs} of {len(dates)} dates failed to load into BQ.')
+        sys.exit(1)